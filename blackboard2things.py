@@ -1,5 +1,6 @@
 import os
 import sys
+import urllib.parse
 import applescript
 from datetime import datetime
 from termcolor import cprint
@@ -32,6 +33,45 @@ def add_exception_to_things(info):
     add_to_things("Handle exception in Blackboard2Things", info)
 
 
+def download_files(s, download_urls):
+    """
+    Download files to DOWNLOAD_PATH (unless DISABLE_DOWNLOAD is set).
+    :param s: instance of ZJUBlackboardSession
+    :param download_urls: list of file urls without the base url
+    :return: note to be appended to Things item
+    """
+
+    things_note = ""
+
+    if DISABLE_DOWNLOAD:
+        return things_note
+
+    for download_url in download_urls:
+        success, filename, size = s.download_file(download_url, DOWNLOAD_PATH, MAXIMAL_DOWNLOAD_SIZE)
+        if success:
+            eprint("  %s downloaded" % filename, None)
+            things_note += "\n[INFO] %s downloaded" % filename
+        else:
+            eprint("  %s is not downloaded due to large size (%d MB)" % (filename, size / 1024 / 1024), None)
+            things_note += "\n[INFO] %s is not downloaded due to large size (%d MB)" % (filename, size / 1024 / 1024)
+
+    return things_note
+
+
+def alert_content_ids(alert):
+    """
+    Get content ids referred by the urls of an alert, to match alerts with nodes from the content crawler.
+    :param alert: one alert entry from inside s.process_raw_entries()
+    :return: set of content ids
+    """
+
+    ret = set()
+    for key in ["url", "file_url", "doc_inner_url", "assignment_inner_url"]:
+        if alert.get(key):
+            ret.update(urllib.parse.parse_qs(urllib.parse.urlparse(alert[key]).query).get("content_id", []))
+    return ret
+
+
 def handle_alert(s, alert):
     """
     Handle alert and generate item to Things.
@@ -65,16 +105,7 @@ def handle_alert(s, alert):
 
         # File
         if alert["content_type"] == "file":
-            if not DISABLE_DOWNLOAD:
-                success, filename, size = s.download_file(alert["file_url"], DOWNLOAD_PATH, MAXIMAL_DOWNLOAD_SIZE)
-                if success:
-                    eprint("  %s downloaded" % filename, None)
-                    things_note = "[INFO] %s downloaded" % filename
-                else:
-                    eprint("  %s is not downloaded due to large size (%d MB)" % (filename, size / 2014 / 1024),
-                           None)
-                    things_note = "[INFO] %s is not downloaded due to large size (%d MB)" % (
-                        filename, size / 2014 / 1024)
+            things_note += download_files(s, [alert["file_url"]])
         # Document
         elif alert["content_type"] == "document":
             things_note += "TYPE: document.\n"
@@ -90,17 +121,7 @@ def handle_alert(s, alert):
                 should_dismiss = False
             else:
                 things_note += doc_data["text"]
-                if not DISABLE_DOWNLOAD:
-                    for download_url in doc_data["attachments"]:
-                        success, filename, size = s.download_file(download_url, DOWNLOAD_PATH, MAXIMAL_DOWNLOAD_SIZE)
-                        if success:
-                            eprint("  %s downloaded" % filename, None)
-                            things_note += "\n[INFO] %s downloaded" % filename
-                        else:
-                            eprint("  %s is not downloaded due to large size (%d MB)" % (filename, size / 2014 / 1024),
-                                   None)
-                            things_note += "\n[INFO] %s is not downloaded due to large size (%d MB)" % (
-                                filename, size / 2014 / 1024)
+                things_note += download_files(s, doc_data["attachments"])
         # Blank
         elif alert["content_type"] == "blank":
             things_note += "TYPE: blank page. See original URL.\n"
@@ -150,17 +171,7 @@ def handle_alert(s, alert):
             should_dismiss = False
         else:
             things_note += ret["content"]
-            if not DISABLE_DOWNLOAD:
-                for attachment in ret["attachments"]:
-                    success, filename, size = s.download_file(attachment, DOWNLOAD_PATH, MAXIMAL_DOWNLOAD_SIZE)
-                    if success:
-                        eprint("  %s downloaded" % filename, None)
-                        things_note += "\n[INFO] %s downloaded" % filename
-                    else:
-                        eprint("  %s is not downloaded due to large size (%d MB)" % (filename, size / 2014 / 1024),
-                               None)
-                        things_note += "\n[INFO] %s is not downloaded due to large size (%d MB)" % (
-                            filename, size / 2014 / 1024)
+            things_note += download_files(s, ret["attachments"])
     # Grade updated
     elif alert["event"] == "grade:update":
         things_title += "grade of " + alert["grade"] + " updated"
@@ -201,6 +212,56 @@ def handle_alert(s, alert):
         add_to_things(things_title, things_note)
 
 
+def handle_content_node(s, node):
+    """
+    Handle a changed content node from the course content crawler and generate item to Things.
+    :param s: instance of ZJUBlackboardSession
+    :param node: one content node from s.crawl_course_content()
+    :return: None
+    """
+
+    # Folders only aggregate changes of their children
+    if node["content_type"] == "folder":
+        return
+
+    course_name = COURSE_CODE_TO_NAME[node["course_id"]]
+
+    things_title = course_name + "content " + node["title"] + " changed"
+    things_note = "TYPE: %s.\n" % node["content_type"]
+    eprint("%s%s" % (course_name, node["title"]), None)
+
+    if node["exception"] is not None:
+        things_title += " [exception]"
+        things_note += "EXCEPTION: " + node["exception"] + "\n"
+        eprint("  Exception from crawler: %s" % node["exception"], "red")
+
+    # File
+    if node["content_type"] == "file":
+        things_note += download_files(s, [node["file_url"]])
+    # Document (page already interpreted by the crawler)
+    elif node["content_type"] == "document" and node["document"] is not None:
+        things_note += node["document"]["text"]
+        things_note += download_files(s, node["document"]["attachments"])
+    # Assignment
+    elif node["content_type"] == "assignment":
+        ret = s.interpret_assignment_page(node["assignment_inner_url"])
+        if ret is None:
+            eprint("  Failed to interpret assignment page", "red")
+            add_exception_to_things("Fail to interpret assignment page %s" % node["url"])
+            things_note += "FAIL TO INTERPRET!\n"
+        else:
+            things_note += ret["content"]
+            things_note += download_files(s, ret["attachments"])
+
+    # Add the original url at the end
+    if node["url"] != "":
+        things_note += '\n' + node["url"]
+
+    # Add to Things Inbox
+    if not DO_NOT_ADD_TO_THINGS:
+        add_to_things(things_title, things_note)
+
+
 if __name__ == '__main__':
 
     if ENCODED_PW == "" or ENCODED_PW_UNICODE == "" or \
@@ -209,6 +270,8 @@ if __name__ == '__main__':
 
     time_stamp = datetime.now().strftime('%Y%m%d%H%M%S')
     s = ZJUBlackboardSession()
+    if CACHE_PAGES:
+        s.page_cache_path = PAGES_PATH
 
     # Login
     if not DISABLE_LOGIN:
@@ -235,6 +298,7 @@ if __name__ == '__main__':
 
     # Process raw entries into alerts
     alerts = s.process_raw_entries(entries)
+    handled_content_ids = set()  # content already reported through alerts
 
     # Check for unknown courses
     unknown_courses = []
@@ -256,6 +320,45 @@ if __name__ == '__main__':
             eprint("Ready to handle %d item(s)..." % (len(alerts)), None)
             for alert in alerts:
                 handle_alert(s, alert)
+                handled_content_ids.update(alert_content_ids(alert))
             print("%d item(s) processed" % len(alerts))
         else:
             print("No alert available")
+
+    # Crawl course content for items that never show up as alerts
+    if CRAWL_COURSE_CONTENT:
+        assert not DISABLE_LOGIN, "Login is disabled and course content can not be crawled."
+        fingerprints_path = os.path.join(DATA_PATH, "content_fingerprints.json")
+        fingerprints = None
+        if os.path.exists(fingerprints_path):
+            with open(fingerprints_path, "r", encoding='utf-8') as fingerprints_file:
+                fingerprints = json.loads(fingerprints_file.read())
+
+        # Courses never crawled before (e.g. added for a new semester) only save a baseline without reporting
+        known_courses = set(record["course_id"] for record in (fingerprints or {}).values())
+        nodes, fingerprints, failed_courses = s.crawl_course_content(list(COURSE_CODE_TO_NAME.keys()), fingerprints)
+
+        # Report crawl failures, so that a subtree failing in every run does not silently stop being watched
+        for course_id, exception in failed_courses.items():
+            add_exception_to_things("Fail to crawl course %s%s: %s" % (
+                COURSE_CODE_TO_NAME[course_id], course_id, exception))
+        for node in nodes:
+            if node["content_type"] == "folder" and node["exception"] is not None:
+                eprint("  Failed to crawl folder %s: %s" % (node["title"], node["exception"]), "red")
+                add_exception_to_things("Fail to crawl folder %s%s: %s\n%s" % (
+                    COURSE_CODE_TO_NAME[node["course_id"]], node["title"], node["exception"], node["url"]))
+
+        baseline_courses = set(node["course_id"] for node in nodes if node["course_id"] not in known_courses)
+        if len(baseline_courses) > 0:
+            print("Saved baseline of course(s) %s" % ", ".join(sorted(baseline_courses)))
+
+        changed_nodes = [node for node in nodes if node["changed"] and node["content_type"] != "folder" and
+                         node["course_id"] in known_courses and node["content_id"] not in handled_content_ids]
+        for node in changed_nodes:
+            handle_content_node(s, node)
+        print("%d content item(s) changed" % len(changed_nodes))
+
+        if not os.path.exists(DATA_PATH):
+            os.makedirs(DATA_PATH)
+        with open(fingerprints_path, "w") as file:
+            file.write(json.dumps(fingerprints, indent=2, separators=(',', ': ')))
@@ -9,6 +9,8 @@ LOGIN_PWD_UNICODE = ""
 # Options
 CURR_PATH = os.path.dirname(os.path.abspath(__file__))
 DATA_PATH = os.path.join(CURR_PATH, "data")
+PAGES_PATH = os.path.join(DATA_PATH, "pages")
+CACHE_PAGES = True  # save fetched document and assignment pages to PAGES_PATH for reprocess.py
 DOWNLOAD_PATH = os.path.join(CURR_PATH, "downloads")
 COURSE_CODE_TO_NAME = {
     # 2019 Spring
@@ -19,6 +21,7 @@ COURSE_CODE_TO_NAME = {
     "_4060_1": "ECON: ",
     "_4101_1": "ECE: ",
 }
+CRAWL_COURSE_CONTENT = False  # also crawl course content areas for items missed by alerts
 
 # Debug Options
 DISABLE_LOGIN = False  # @default: False. If login is disabled, program may not have access to download file
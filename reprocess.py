@@ -0,0 +1,132 @@
+import os
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from zju_blackboard import ZJUBlackboardSession, eprint
+from config import DATA_PATH, PAGES_PATH
+
+CHUNK_SIZE = 64  # number of entries or pages processed in one task
+WORKERS = os.cpu_count() or 1
+WINDOW = WORKERS * 2  # number of chunks submitted to the pool at a time
+
+_session = None  # session of each worker process, only used as the processor
+
+
+def _init_worker():
+    global _session
+    _session = ZJUBlackboardSession()
+
+
+def collect_jobs():
+    """
+    Collect archived raw entries in DATA_PATH and cached pages in PAGES_PATH, in a stable order.
+    :return: list of (kind, source, index, url, data) tuples, where kind is "entry", "document" or "assignment",
+             url is the inner url of the page (None for entries), and data is the raw entry or the path of the page
+    """
+
+    jobs = []
+
+    if os.path.exists(DATA_PATH):
+        for filename in sorted(os.listdir(DATA_PATH)):
+            # Archives are named by time stamp (see blackboard2things.py)
+            if not filename.endswith(".json") or not filename[:-len(".json")].isdigit():
+                continue
+            with open(os.path.join(DATA_PATH, filename), "r", encoding='utf-8') as file:
+                entries = json.loads(file.read())
+            for index, entry in enumerate(entries):
+                jobs.append(("entry", filename, index, None, entry))
+
+    for kind in ["document", "assignment"]:
+        page_path = os.path.join(PAGES_PATH, kind)
+        if not os.path.exists(page_path):
+            continue
+        pages = []
+        for filename in os.listdir(page_path):
+            if not filename.endswith(".html"):
+                continue
+            # The url is saved next to the page by ZJUBlackboardSession.cache_page()
+            url_path = os.path.join(page_path, filename[:-len(".html")] + ".url")
+            url = ""
+            if os.path.exists(url_path):
+                with open(url_path, "r", encoding='utf-8') as file:
+                    url = file.read().strip()
+            pages.append((url, filename))
+        for url, filename in sorted(pages):
+            jobs.append((kind, os.path.join(kind, filename), 0, url, os.path.join(page_path, filename)))
+
+    return jobs
+
+
+def process_chunk(chunk):
+    """
+    Process a chunk of jobs in a worker process.
+    :param chunk: list of jobs (see collect_jobs())
+    :return: list of results in the same order as the chunk
+
+    Exceptions are caught per job and encoded into result["exception"], so
+    that one malformed entry does not fail the whole chunk.
+    """
+
+    ret = []
+
+    for kind, source, index, url, data in chunk:
+        result = {
+            "kind": kind,
+            "source": source,
+            "index": index,
+            "url": url,
+            "result": None,
+            "exception": None
+        }
+        try:
+            if kind == "entry":
+                alert = _session.process_raw_entries([data])[0]
+                del alert["raw"]  # already in the archive
+                result["result"] = alert
+            else:
+                with open(data, "r", encoding='utf-8') as file:
+                    raw_text = file.read()
+                if kind == "document":
+                    result["result"] = _session.process_document_raw(raw_text)
+                else:
+                    result["result"] = _session.process_assignment_page_raw(raw_text)
+        except Exception as e:
+            result["exception"] = "%s: %s" % (type(e).__name__, e)
+        ret.append(result)
+
+    return ret
+
+
+if __name__ == '__main__':
+
+    jobs = collect_jobs()
+    chunks = [jobs[i:i + CHUNK_SIZE] for i in range(0, len(jobs), CHUNK_SIZE)]
+    eprint("Reprocessing %d item(s) in %d chunk(s) with %d worker(s)..." % (len(jobs), len(chunks), WORKERS), None)
+
+    start_time = time.time()
+    processed = 0
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker) as pool:
+        # Submit chunks in a bounded window instead of pickling all of them into the pool at once. Results are
+        # collected in submission order (a slow chunk holds back the ones after it), so the output is the same
+        # across runs and can be diffed
+        window = deque()
+        next_chunk = 0
+        while next_chunk < len(chunks) or window:
+            while next_chunk < len(chunks) and len(window) < WINDOW:
+                window.append(pool.submit(process_chunk, chunks[next_chunk]))
+                next_chunk += 1
+            results = window.popleft().result()
+            for result in results:
+                print(json.dumps(result, ensure_ascii=False, sort_keys=True))
+                if result["exception"] is not None:
+                    failed += 1
+            processed += len(results)
+            elapsed = time.time() - start_time
+            eprint("  %d/%d item(s), %.1f item(s)/s" % (processed, len(jobs), processed / max(elapsed, 1e-6)), None)
+
+    elapsed = time.time() - start_time
+    eprint("%d item(s) reprocessed in %.1f s (%.1f item(s)/s), %d failed" % (
+        processed, elapsed, processed / max(elapsed, 1e-6), failed), "red" if failed > 0 else None)
@@ -5,6 +5,11 @@ import json
 import time
 import math
 import random
+import hashlib
+import concurrent.futures
+import threading
+import queue
+import urllib.parse
 from termcolor import cprint
 from pyquery import PyQuery
 from html2text import html2text
@@ -24,6 +29,19 @@ def eprint(*args, **kwargs):
 class ZJUBlackboardSession:
 
     ALERT_FETCH_INTERVAL = 1  # [s]
+    CONTENT_CRAWL_WORKERS = 8  # number of pages fetched concurrently by crawl_course_content()
+
+    # Icon file name prefix in content list -> content type (same naming as alert["content_type"])
+    CONTENT_ICON_TO_TYPE = {
+        "folder": "folder",
+        "document": "document",
+        "file": "file",
+        "assignment": "assignment",
+        "link": "external_link",
+        "blankpage": "blank",
+        "video": "video",
+        "discussion": "forum_link",
+    }
 
     def __init__(self):
         self.s = requests.Session()
@@ -33,6 +51,9 @@ class ZJUBlackboardSession:
             "User-Agent": "Mozilla/5.0"
         })
 
+        # If not None, pages fetched by interpret_*() are saved to <page_cache_path>/<type>/ for reprocessing
+        self.page_cache_path = None
+
     def login(self, encoded_pw, encoded_pw_unicode, login_uid_unicode, login_pwd_unicode):
         """
         :return: True if success, False otherwise
@@ -355,6 +376,7 @@ class ZJUBlackboardSession:
         if ret.status_code != 200:
             return None
 
+        self.cache_page("document", inner_url, ret.text)
         return self.process_document_raw(ret.text)
 
     def process_assignment_page_raw(self, raw_text):
@@ -398,8 +420,333 @@ class ZJUBlackboardSession:
         if ret.status_code != 200:
             return None
 
+        self.cache_page("assignment", inner_url, ret.text)
         return self.process_assignment_page_raw(ret.text)
 
+    def cache_page(self, page_type, inner_url, raw_text):
+        """
+        Save page source to page_cache_path, if set. A page fetched again overwrites the previous one.
+        The page is saved as <sha1 of url>.html, with its url in <sha1 of url>.url next to it.
+        :param page_type: "document" or "assignment"
+        :param inner_url: page url without the base url (c.zju.edu.cn)
+        :param raw_text: string of page source
+        :return: None
+        """
+
+        if self.page_cache_path is None:
+            return
+
+        save_path = os.path.join(self.page_cache_path, page_type)
+        os.makedirs(save_path, exist_ok=True)  # may be called from several threads by crawl_course_content()
+
+        filename = hashlib.sha1(inner_url.encode("utf-8")).hexdigest()
+        with open(os.path.join(save_path, filename + ".html"), "w", encoding='utf-8') as file:
+            file.write(raw_text)
+        with open(os.path.join(save_path, filename + ".url"), "w", encoding='utf-8') as file:
+            file.write(inner_url)
+
+    def process_course_menu_raw(self, raw_text, course_id):
+        """
+        Process the page source of course main page and extract content areas from the course menu.
+        Please leave this function alone for unit test.
+        :param raw_text: string of course main page
+        :param course_id: id of the course, such as _4069_1
+        :return: list of content nodes (see crawl_course_content())
+        """
+
+        ret = []
+
+        doc = PyQuery(str(raw_text))
+
+        for link in doc("#courseMenuPalette_contents")("li")("a").items():
+            href = link.attr("href")
+            if not href or "listContent.jsp" not in href:
+                continue  # not a content area (announcements, tools, etc.)
+            content_id = urllib.parse.parse_qs(urllib.parse.urlparse(href).query).get("content_id", [""])[0]
+            if content_id == "":
+                continue
+            title = link.text().strip()
+            ret.append(self._new_content_node(course_id, content_id, None, title, "folder", href, title))
+
+        return ret
+
+    def process_content_list_raw(self, raw_text, course_id, parent_id):
+        """
+        Process the page source of a content folder (listContent.jsp).
+        Please leave this function alone for unit test.
+        :param raw_text: string of folder page
+        :param course_id: id of the course, such as _4069_1
+        :param parent_id: content id of the folder
+        :return: list of content nodes (see crawl_course_content())
+        """
+
+        ret = []
+
+        doc = PyQuery(str(raw_text))
+
+        for item in doc("#content_listContainer").children("li").items():
+            item_id = item.attr("id") or ""
+            if not item_id.startswith("contentListItem:"):
+                continue
+            content_id = item_id.split(":", 1)[1]
+
+            title = item.find("div.item h3").text().strip()
+            href = item.find("div.item h3 a").attr("href") or ""
+            details = item.find("div.details").html() or ""
+
+            icon = (item.find("img.item_icon").attr("src") or "").split("/")[-1].split("_on")[0]
+            content_type = self.CONTENT_ICON_TO_TYPE.get(icon, "unknown")
+
+            node = self._new_content_node(course_id, content_id, parent_id, title, content_type, href,
+                                          content_type + title + href + details)
+            if content_type == "file":
+                node["file_url"] = href
+            elif content_type == "document":
+                node["doc_inner_url"] = "/webapps/blackboard/execute/displayIndividualContent" \
+                                        "?course_id=%s&content_id=%s" % (course_id, content_id)
+            elif content_type == "assignment":
+                node["assignment_inner_url"] = href
+            elif content_type == "unknown":
+                node["exception"] = "Unhandled content icon '%s'" % icon
+            ret.append(node)
+
+        return ret
+
+    def _new_content_node(self, course_id, content_id, parent_id, title, content_type, inner_url, signature):
+        """
+        Initialize a content node. The fingerprint of a folder is only the one of its own entry, and it is
+        updated to cover its whole subtree at the end of crawl_course_content().
+        """
+
+        return {
+            "course_id": course_id,
+            "content_id": content_id,
+            "parent_id": parent_id,
+            "title": title,
+            "content_type": content_type,
+            "url": urllib.parse.urljoin(self.base_url, inner_url) if inner_url else "",  # web links may be absolute
+            "children": [],
+            "fingerprint": hashlib.sha1(signature.encode("utf-8")).hexdigest(),
+            "changed": False,
+            "document": None,
+            "exception": None
+        }
+
+    def fetch_content_areas(self, course_id):
+        """
+        Fetch content areas in the course menu.
+        :param course_id: id of the course, such as _4069_1
+        :return: list of content nodes, or None if failed
+        """
+
+        ret = self.s.get(self.base_url + "/webapps/blackboard/execute/courseMain", params={"course_id": course_id})
+
+        if ret.status_code != 200:
+            return None
+
+        return self.process_course_menu_raw(ret.text, course_id)
+
+    def fetch_content_list(self, course_id, content_id):
+        """
+        Fetch items in a content folder.
+        :param course_id: id of the course, such as _4069_1
+        :param content_id: content id of the folder
+        :return: list of content nodes, or None if failed
+        """
+
+        ret = self.s.get(self.base_url + "/webapps/blackboard/content/listContent.jsp",
+                         params={"course_id": course_id, "content_id": content_id})
+
+        if ret.status_code != 200:
+            return None
+
+        return self.process_content_list_raw(ret.text, course_id, content_id)
+
+    def _copy(self):
+        """
+        Create a session with the same login state, for use in another thread.
+        requests.Session is not guaranteed to be thread-safe, so the crawler does not share self.s among threads.
+        """
+
+        ret = ZJUBlackboardSession()
+        ret.base_url = self.base_url
+        ret.page_cache_path = self.page_cache_path
+        ret.s.headers.update(self.s.headers)
+        ret.s.cookies.update(self.s.cookies)
+        return ret
+
+    def crawl_course_content(self, course_ids, fingerprints=None):
+        """
+        Walk the content areas of given courses, fetching folders concurrently.
+        :param course_ids: list of course ids, such as keys of COURSE_CODE_TO_NAME
+        :param fingerprints: fingerprints returned by the last crawl, or None for a full crawl
+        :return: (list of content nodes in tree order, fingerprints for the next crawl,
+                  dict of course_id -> error message for courses whose content areas failed to load)
+
+        Each content node is a dict with the following fields:
+        "course_id", "content_id", "parent_id" (None for content areas), "title", "url", "children" (list of
+        content ids), "fingerprint", "changed" (fingerprint differs from the last crawl), "exception" (None or
+        string), and "content_type", one of "folder", "document", "file", "assignment", "external_link",
+        "blank", "video", "forum_link" and "unknown". Like alerts, files come with "file_url", documents with
+        "doc_inner_url" and assignments with "assignment_inner_url".
+
+        Fingerprints are a dict of content_id -> {"fingerprint", "course_id", "parent_id"} that can be saved as
+        JSON. Document pages are only fetched when their fingerprint changed, and the result of
+        process_document_raw() is stored in node["document"] (None if not fetched or failed). Courses without
+        any record in fingerprints are crawled as a baseline, without fetching document pages. Blackboard does
+        not expose modification time of folders, so folder lists are fetched in every crawl. The fingerprint of
+        a folder covers its whole subtree, so node["changed"] of a folder tells whether anything inside changed.
+
+        If a course menu or a folder list fails to load, its subtree keeps the fingerprints from the last crawl,
+        so that the items in it are not reported as changed again once it loads.
+
+        Pages are fetched concurrently, but the tree is built in the order of course_ids and of the items in
+        each folder, so a folder linked from several places is always attached to the same parent.
+        """
+
+        if fingerprints is None:
+            fingerprints = {}
+        known_courses = set(record["course_id"] for record in fingerprints.values())
+
+        def old_fingerprint(content_id):
+            return fingerprints.get(content_id, {}).get("fingerprint")
+
+        menus = {}  # course_id -> list of content areas
+        lists = {}  # content_id -> list of items in the folder
+        documents = {}  # content_id -> result of interpret_document()
+        course_errors = {}  # course_id -> error message
+        errors = {}  # content_id -> error message
+        requested = set()  # content ids whose folder list or document page is requested
+
+        # Each worker thread takes its own copy of the session
+        sessions = queue.Queue()
+        for _ in range(self.CONTENT_CRAWL_WORKERS):
+            sessions.put(self._copy())
+        local = threading.local()
+
+        def call(method, *args):
+            if not hasattr(local, "session"):
+                local.session = sessions.get_nowait()
+            return getattr(local.session, method)(*args)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.CONTENT_CRAWL_WORKERS) as pool:
+
+            pending = {}
+            for course_id in course_ids:
+                pending[pool.submit(call, "fetch_content_areas", course_id)] = ("menu", course_id, course_id)
+
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    kind, course_id, key = pending.pop(future)
+
+                    try:
+                        result = future.result()
+                        error = ""
+                    except Exception as e:  # connection error, timeout, unexpected page, etc.
+                        result = None
+                        error = " (%s: %s)" % (type(e).__name__, e)
+
+                    if kind == "document":
+                        documents[key] = result
+                        if result is None:
+                            errors[key] = "Failed to interpret document" + error
+                        continue
+
+                    if result is None:
+                        if kind == "menu":
+                            course_errors[key] = "Failed to fetch content areas of course %s%s" % (key, error)
+                            eprint(course_errors[key], "red")
+                        else:
+                            errors[key] = "Failed to fetch content list" + error
+                        continue
+                    (menus if kind == "menu" else lists)[key] = result
+
+                    for child in result:
+                        content_id = child["content_id"]
+                        if content_id in requested:
+                            continue
+                        if child["content_type"] == "folder":
+                            requested.add(content_id)
+                            pending[pool.submit(call, "fetch_content_list", course_id, content_id)] = (
+                                "list", course_id, content_id)
+                        elif child["content_type"] == "document" and course_id in known_courses and \
+                                child["fingerprint"] != old_fingerprint(content_id):
+                            requested.add(content_id)
+                            pending[pool.submit(call, "interpret_document", child["doc_inner_url"])] = (
+                                "document", course_id, content_id)
+
+        # Build the tree in a fixed order, depth first
+        nodes = {}
+        ret = []
+        failed_folders = set()
+        stack = []
+        for course_id in reversed(course_ids):
+            stack.extend((area, None) for area in reversed(menus.get(course_id, [])))
+        while stack:
+            node, parent = stack.pop()
+            content_id = node["content_id"]
+            if content_id in nodes:
+                continue  # the same item may be linked from several places, keep the first one
+            nodes[content_id] = node
+            ret.append(node)
+            if parent is not None:
+                parent["children"].append(content_id)
+                node["course_id"] = parent["course_id"]  # the folder may be fetched through another course
+
+            if node["content_type"] == "folder":
+                if content_id in lists:
+                    stack.extend((child, node) for child in reversed(lists[content_id]))
+                else:
+                    node["exception"] = errors.get(content_id, "Failed to fetch content list")
+                    failed_folders.add(content_id)
+            else:
+                node["changed"] = node["fingerprint"] != old_fingerprint(content_id)
+                if node["content_type"] == "document" and content_id in documents:
+                    node["document"] = documents[content_id]
+                    if node["document"] is None:
+                        node["exception"] = errors[content_id]
+                        node["fingerprint"] = ""  # retry in the next crawl
+
+        # Fold fingerprints of children into folders, bottom-up
+        for node in reversed(ret):
+            if node["content_type"] != "folder":
+                continue
+            if node["content_id"] in failed_folders:
+                # Unknown subtree. Keep the last fingerprint instead of folding it as an empty folder
+                node["fingerprint"] = old_fingerprint(node["content_id"]) or node["fingerprint"]
+                continue
+            signature = node["fingerprint"] + "".join(nodes[c]["fingerprint"] for c in node["children"])
+            node["fingerprint"] = hashlib.sha1(signature.encode("utf-8")).hexdigest()
+            node["changed"] = node["fingerprint"] != old_fingerprint(node["content_id"])
+
+        eprint("Crawled %d content item(s), %d changed" % (len(ret), sum(1 for node in ret if node["changed"])), None)
+
+        new_fingerprints = {}
+        for node in ret:
+            if node["content_id"] in failed_folders and node["content_id"] not in fingerprints:
+                continue  # never fully crawled, nothing to compare with
+            new_fingerprints[node["content_id"]] = {
+                "fingerprint": node["fingerprint"],
+                "course_id": node["course_id"],
+                "parent_id": node["parent_id"]
+            }
+
+        # Carry over fingerprints of subtrees that were not crawled this time
+        failed_courses = {course_id: course_errors[course_id] for course_id in course_ids if course_id not in menus}
+        for content_id, record in fingerprints.items():
+            if content_id in nodes:
+                continue
+            ancestor = record["parent_id"]
+            visited = set()
+            while ancestor is not None and ancestor not in failed_folders and ancestor not in visited:
+                visited.add(ancestor)
+                ancestor = fingerprints.get(ancestor, {}).get("parent_id")
+            if record["course_id"] in failed_courses or ancestor is not None and ancestor in failed_folders:
+                new_fingerprints[content_id] = record
+
+        return ret, new_fingerprints, failed_courses
+
 
 if __name__ == '__main__':
     p = ZJUBlackboardSession()